@@ -1,16 +1,25 @@
 import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import hashlib
 import os
 import re
 import json
+import aiofiles
+import aiofiles.os as aos
+import orjson
 import yt_dlp
-from typing import Union, Optional, Tuple
+from cachetools import TTLCache
+from typing import Awaitable, Callable, Union, Optional, Tuple
 from pyrogram.enums import MessageEntityType
 from pyrogram.types import Message
-from youtubesearchpython.__future__ import VideosSearch
 import logging
-import random
+import itertools
+import time
 from typing import List
 
+from AviaxMusic.utils.formatters import seconds_to_min
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -23,36 +32,321 @@ DOWNLOAD_FOLDER = "downloads"
 MAX_RETRIES = 3
 RETRY_DELAY = 2
 MAX_FILE_SIZE_MB = 250  # Maximum allowed file size in MB
+SOCKET_TIMEOUT = 10  # Seconds before a stalled yt-dlp connection is dropped
+EXTRACT_TIMEOUT = 30  # Seconds allowed for a metadata extraction
+PLAYLIST_PREFETCH_LIMIT = 4  # Concurrent extractions, wider gets rate-limited
+
+INFO_CACHE_TTL = 900  # Seconds, well within YouTube's signed URL lifetime
+INFO_CACHE_FOLDER = os.path.join("cache", "ytinfo")
+
+_DOWNLOAD_OUTTMPL = os.path.join(DOWNLOAD_FOLDER, "%(id).2s", "%(id)s.%(ext)s")
+
+# Download selectors bounded by MAX_FILE_SIZE_MB so oversized media is never
+# fetched; formats without size metadata are caught by max_filesize instead
+_SIZE_FILTER = f"[filesize<=?{MAX_FILE_SIZE_MB}M][filesize_approx<=?{MAX_FILE_SIZE_MB}M]"
+_DOWNLOAD_FORMATS = {
+    "audio": f"(ba/b){_SIZE_FILTER}",
+    "video": f"(bv*[height<=720]+ba/b[height<=720]){_SIZE_FILTER}",
+}
+
+# Format listing only needs metadata, skip the extra DASH manifest request
+_FORMAT_LIST_OPTS = {
+    "youtube_include_dash_manifest": False,
+}
+
+# URL patterns, compiled once at import
+_VIDEO_ID_RE = re.compile(
+    r"youtube\.com/watch\?v=(?P<watch>[^&]+)"
+    r"|youtu\.be/(?P<short>[^?]+)"
+    r"|youtube\.com/embed/(?P<embed>[^/]+)"
+    r"|youtube\.com/v/(?P<v>[^/]+)"
+    r"|youtube\.com/shorts/(?P<shorts>[^/?&]+)"
+    r"|youtube\.com/live/(?P<live>[^/?&]+)"
+)
+_SAFE_VIDEO_ID_RE = re.compile(r"[\w-]+")
+_ANSI_ESCAPE_RE = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
 
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+os.makedirs(INFO_CACHE_FOLDER, exist_ok=True)
 
-def cookie_txt_file() -> Optional[str]:
-    """Get a random cookie file from cookies directory"""
-    cookie_dir = os.path.join(os.getcwd(), "cookies")
-    if not os.path.exists(cookie_dir):
-        return None
+# Metadata caches: (expires_at, info) keyed on (kind, video_id) and search
+# results keyed on the normalized query
+_INFO_CACHE = TTLCache(maxsize=1024, ttl=INFO_CACHE_TTL)
+_SEARCH_CACHE = TTLCache(maxsize=1024, ttl=INFO_CACHE_TTL)
+
+# Last sweep of expired info dicts spilled to INFO_CACHE_FOLDER
+_INFO_CACHE_PRUNED_AT = 0.0
+
+# In-flight extractions/downloads, concurrent callers share one future
+_INFLIGHT: dict = {}
+
+# ffmpeg is CPU bound, run at most one transcode per core while downloads
+# proceed freely
+_TRANSCODE_SEMAPHORE = asyncio.Semaphore(os.cpu_count() or 1)
+
+# Idle YoutubeDL instances keyed on (kind, cookie_file, cookie_mtime).
+# YoutubeDL is not thread-safe, so each instance is checked out by one
+# worker at a time
+YDL_POOL_SIZE = 4  # Idle instances kept per key
+_YDL_POOL: dict = {}
+
+# Cookie file paths and the time they were listed, refreshed every COOKIES_TTL
+COOKIES_TTL = 60
+_COOKIE_DIR = os.path.join(os.getcwd(), "cookies")
+_COOKIES_CACHE: Tuple[List[str], float] = ([], float("-inf"))
+_COOKIE_MTIMES: dict = {}
+
+# Downloads are sharded into DOWNLOAD_FOLDER/<first two id chars>/ so no
+# single directory grows unbounded
+_SHARDS: set = set()
+
+# Cookie file pinned for the current logical operation, see sticky_cookie()
+_COOKIE_VAR: ContextVar[Optional[str]] = ContextVar("cookie", default=None)
+_COOKIE_TURN = itertools.count()
+
+# File names under the shards, swept once at startup and kept up to date on
+# every successful download
+_DOWNLOADED: set = set()
+
+with os.scandir(DOWNLOAD_FOLDER) as _shards:
+    for _shard in _shards:
+        if _shard.is_dir():
+            _SHARDS.add(_shard.name)
+            with os.scandir(_shard.path) as _entries:
+                _DOWNLOADED.update(e.name for e in _entries if e.is_file())
+
+async def _shard_dir(video_id: str) -> str:
+    """Get the download shard directory for a video, creating it on first use"""
+    prefix = video_id[:2]
+    shard = f"{DOWNLOAD_FOLDER}/{prefix}"
+    if prefix not in _SHARDS:
+        await aos.makedirs(shard, exist_ok=True)
+        _SHARDS.add(prefix)
+    return shard
+
+async def cookie_txt_file() -> Optional[str]:
+    """Get the sticky cookie file if set, else the next one round-robin"""
+    global _COOKIES_CACHE
+    sticky = _COOKIE_VAR.get()
+    if sticky:
+        return sticky
+    
+    cookies_files, listed_at = _COOKIES_CACHE
+    if time.monotonic() - listed_at > COOKIES_TTL:
+        cookies_files = []
+        if await aos.path.exists(_COOKIE_DIR):
+            cookies_files = [
+                f"{_COOKIE_DIR}/{f}" for f in await aos.listdir(_COOKIE_DIR) if f.endswith(".txt")
+            ]
+        mtimes = {}
+        for path in cookies_files:
+            try:
+                mtimes[path] = (await aos.stat(path)).st_mtime
+            except OSError:
+                pass
+        _COOKIE_MTIMES.clear()
+        _COOKIE_MTIMES.update(mtimes)
+        _COOKIES_CACHE = (cookies_files, time.monotonic())
     
-    cookies_files = [f for f in os.listdir(cookie_dir) if f.endswith(".txt")]
     if not cookies_files:
         return None
     
-    return os.path.join(cookie_dir, random.choice(cookies_files))
+    return cookies_files[next(_COOKIE_TURN) % len(cookies_files)]
+
+@asynccontextmanager
+async def sticky_cookie():
+    """Use one cookie file for every yt-dlp call made inside the block"""
+    token = _COOKIE_VAR.set(await cookie_txt_file())
+    try:
+        yield
+    finally:
+        _COOKIE_VAR.reset(token)
 
 def extract_video_id(url: str) -> Optional[str]:
     """Extract YouTube video ID from URL"""
-    patterns = [
-        r"youtube\.com/watch\?v=([^&]+)",
-        r"youtu\.be/([^?]+)",
-        r"youtube\.com/embed/([^/]+)",
-        r"youtube\.com/v/([^/]+)"
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
+    match = _VIDEO_ID_RE.search(url)
+    if match:
+        return next((g for g in match.groups() if g), None)
     return None
 
+def _pool_key(opts_key: tuple) -> tuple:
+    """Pool key for (kind, cookie_file), including the cookie file's mtime"""
+    return opts_key + (_COOKIE_MTIMES.get(opts_key[1]),)
+
+def _release_ydl(pool_key: tuple, ydl: yt_dlp.YoutubeDL) -> None:
+    """Return a YoutubeDL instance to the pool, closing it if the pool is full"""
+    if pool_key != _pool_key(pool_key[:2]):
+        # The cookie file was replaced since this instance loaded it, drop it
+        # rather than saving its stale jar over the new file
+        return
+    idle = _YDL_POOL.setdefault(pool_key, [])
+    if len(idle) < YDL_POOL_SIZE:
+        idle.append(ydl)
+    else:
+        # Closing saves the cookie jar back to the cookie file
+        ydl.close()
+
+@asynccontextmanager
+async def _pooled_ydl(opts_key: tuple, ydl_opts: dict):
+    """Check out a YoutubeDL instance for exclusive use"""
+    pool_key = _pool_key(opts_key)
+    for stale in [k for k in _YDL_POOL if k[:2] == opts_key and k != pool_key]:
+        del _YDL_POOL[stale]
+    
+    idle = _YDL_POOL.get(pool_key)
+    ydl = idle.pop() if idle else yt_dlp.YoutubeDL(ydl_opts)
+    try:
+        yield ydl
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        # The worker thread may still be running on it, never hand it out again
+        raise
+    except Exception:
+        _release_ydl(pool_key, ydl)
+        raise
+    _release_ydl(pool_key, ydl)
+
+async def _coalesce(key: tuple, factory: Callable[[], Awaitable]):
+    """Run factory() once per key, concurrent callers await the same future"""
+    future = _INFLIGHT.get(key)
+    if future is None:
+        future = _INFLIGHT[key] = asyncio.ensure_future(factory())
+        future.add_done_callback(lambda _: _INFLIGHT.pop(key, None))
+    # Shielded so one cancelled caller doesn't cancel the others
+    return await asyncio.shield(future)
+
+async def _extract_with_timeout(opts_key: tuple, ydl_opts: dict, url: str) -> Optional[dict]:
+    """
+    Extract info without downloading on a pooled YoutubeDL, giving up after
+    EXTRACT_TIMEOUT. The worker thread can't be interrupted, so a timed-out
+    instance is left to it and dropped from the pool.
+    """
+    try:
+        async with _pooled_ydl(opts_key, ydl_opts) as ydl:
+            return await asyncio.wait_for(
+                asyncio.to_thread(ydl.extract_info, url, download=False),
+                timeout=EXTRACT_TIMEOUT,
+            )
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out extracting info for {url}")
+        return None
+
+def _info_cache_path(key: tuple) -> str:
+    name = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(INFO_CACHE_FOLDER, f"{name}.json")
+
+def _prune_info_cache() -> None:
+    """Remove info dicts spilled to disk more than INFO_CACHE_TTL ago"""
+    global _INFO_CACHE_PRUNED_AT
+    _INFO_CACHE_PRUNED_AT = time.time()
+    cutoff = _INFO_CACHE_PRUNED_AT - INFO_CACHE_TTL
+    with os.scandir(INFO_CACHE_FOLDER) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+_prune_info_cache()
+
+async def _load_cached_info(key: tuple) -> Optional[Tuple[float, dict]]:
+    """
+    Read an info dict spilled to disk as (fetched_at, info), if it's still
+    within INFO_CACHE_TTL
+    """
+    path = _info_cache_path(key)
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            entry = orjson.loads(await f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug(f"Ignoring unreadable info cache {path}: {str(e)}")
+        return None
+    if time.time() - entry["ts"] > INFO_CACHE_TTL:
+        try:
+            await aos.remove(path)
+        except OSError:
+            pass
+        return None
+    return entry["ts"], entry["info"]
+
+async def _store_cached_info(key: tuple, fetched_at: float, info: dict) -> None:
+    """Spill an info dict to disk so it survives restarts"""
+    path = _info_cache_path(key)
+    tmp_path = f"{path}.tmp"
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            await f.write(orjson.dumps({"ts": fetched_at, "info": info}))
+        # Readers only ever see a complete file
+        await aos.replace(tmp_path, path)
+    except Exception as e:
+        logger.debug(f"Failed to write info cache {path}: {str(e)}")
+    
+    if time.time() - _INFO_CACHE_PRUNED_AT > INFO_CACHE_TTL:
+        await asyncio.to_thread(_prune_info_cache)
+
+async def _extract_info(key: tuple, link: str, kind: str, ydl_opts: dict) -> Optional[dict]:
+    cached = await _load_cached_info(key)
+    if cached:
+        fetched_at, info = cached
+    else:
+        fetched_at = time.time()
+        info = await _extract_with_timeout((kind, ydl_opts.get("cookiefile")), ydl_opts, link)
+        if info:
+            info = yt_dlp.YoutubeDL.sanitize_info(info)
+            await _store_cached_info(key, fetched_at, info)
+    if info:
+        # The expiry travels with the entry so a disk hit isn't kept in
+        # memory past its original TTL
+        _INFO_CACHE[key] = (fetched_at + INFO_CACHE_TTL, info)
+    return info
+
+async def _cached_extract_info(link: str, kind: str, ydl_opts: dict) -> Optional[dict]:
+    """Extract info without downloading, served from the TTL cache when possible"""
+    key = (kind, extract_video_id(link) or link)
+    entry = _INFO_CACHE.get(key)
+    if entry and entry[0] > time.time():
+        return entry[1]
+    return await _coalesce(
+        ("info",) + key, lambda: _extract_info(key, link, kind, ydl_opts)
+    )
+
+async def _cached_search(query: str, limit: int) -> List[dict]:
+    """Search YouTube through yt-dlp, served from the TTL cache when possible"""
+    key = (query, limit)
+    if key not in _SEARCH_CACHE:
+        cookie_file = await cookie_txt_file()
+        ydl_opts = {
+            "quiet": True,
+            "no_warnings": True,
+            "socket_timeout": SOCKET_TIMEOUT,
+            "extract_flat": "in_playlist",
+            "default_search": "ytsearch",
+        }
+        if cookie_file:
+            ydl_opts["cookiefile"] = cookie_file
+        
+        info = await _extract_with_timeout(
+            ("search", cookie_file), ydl_opts, f"ytsearch{limit}:{query}"
+        )
+        if not info:
+            return []
+        _SEARCH_CACHE[key] = info.get("entries") or []
+    return _SEARCH_CACHE[key]
+
+def _entry_duration(entry: dict) -> Optional[str]:
+    """Format a search entry's duration, None for live streams"""
+    duration = entry.get("duration")
+    return seconds_to_min(duration) if duration else None
+
+def _entry_thumbnail(entry: dict) -> str:
+    """Get the largest thumbnail of a search entry without query params"""
+    thumbnails = entry.get("thumbnails")
+    if thumbnails:
+        return thumbnails[-1]["url"].split("?")[0]
+    return f"https://i.ytimg.com/vi/{entry['id']}/hqdefault.jpg"
+
 async def download_with_yt_dlp(
     link: str, 
     media_type: str, 
@@ -60,60 +354,157 @@ async def download_with_yt_dlp(
     title: Optional[str] = None
 ) -> Optional[str]:
     """Download media using yt-dlp with cookies"""
-    cookie_file = cookie_txt_file()
-    if not cookie_file:
-        logger.warning("No cookies found. Some videos may not download.")
-    
     video_id = extract_video_id(link) or link.split('v=')[-1].split('&')[0]
+    # The ID is used to build paths below, make sure it can't escape them
+    if not _SAFE_VIDEO_ID_RE.fullmatch(video_id):
+        logger.error(f"Refusing to download unexpected video ID: {video_id!r}")
+        return None
     
     # Check cache first
     ext = "mp3" if media_type == "audio" else "mp4"
-    file_path = os.path.join(DOWNLOAD_FOLDER, f"{video_id}.{ext}")
-    if os.path.exists(file_path):
-        logger.info(f"Using cached file: {file_path}")
-        return file_path
+    file_name = f"{video_id}.{ext}"
+    file_path = f"{DOWNLOAD_FOLDER}/{video_id[:2]}/{file_name}"
+    if file_name in _DOWNLOADED:
+        if await aos.path.exists(file_path):
+            logger.info(f"Using cached file: {file_path}")
+            return file_path
+        # Removed behind our back, e.g. by auto_clean
+        _DOWNLOADED.discard(file_name)
+    
+    return await _coalesce(
+        ("download", media_type, video_id, format_id, title),
+        lambda: _download(link, media_type, video_id, format_id, title),
+    )
+
+async def _download(
+    link: str,
+    media_type: str,
+    video_id: str,
+    format_id: Optional[str],
+    title: Optional[str],
+) -> Optional[str]:
+    cookie_file = await cookie_txt_file()
+    if not cookie_file:
+        logger.warning("No cookies found. Some videos may not download.")
     
+    shard = await _shard_dir(video_id)
     ydl_opts = {
-        "format": "bestaudio/best" if media_type == "audio" else "bestvideo[height<=720]+bestaudio",
-        "outtmpl": os.path.join(DOWNLOAD_FOLDER, f"{video_id}.%(ext)s"),
+        "format": _DOWNLOAD_FORMATS[media_type],
+        "max_filesize": MAX_FILE_SIZE_MB * 1024 * 1024,
+        "outtmpl": _DOWNLOAD_OUTTMPL,
         "quiet": True,
         "no_warnings": True,
+        "socket_timeout": SOCKET_TIMEOUT,
         "geo_bypass": True,
         "nocheckcertificate": True,
+        "retries": MAX_RETRIES,
+        "fragment_retries": MAX_RETRIES,
+        "retry_sleep_functions": {
+            "http": _retry_backoff,
+            "fragment": _retry_backoff,
+        },
     }
     
     if cookie_file:
         ydl_opts["cookiefile"] = cookie_file
     
-    if media_type == "audio":
-        ydl_opts["postprocessors"] = [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }]
-    
     if format_id and title:
         ydl_opts["format"] = format_id
-        ydl_opts["outtmpl"] = os.path.join(DOWNLOAD_FOLDER, title)
+        ydl_opts["outtmpl"] = os.path.join(shard, title)
         if media_type == "audio":
             ydl_opts["outtmpl"] += ".%(ext)s"
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = await asyncio.to_thread(ydl.extract_info, link, download=True)
-            ext = "mp3" if media_type == "audio" else info['ext']
-            file_path = os.path.join(DOWNLOAD_FOLDER, f"{video_id}.{ext}")
-            
-            if os.path.exists(file_path):
-                return file_path
+        if format_id and title:
+            # Custom output names are one-off, keep them out of the pool
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = await _download_with_retries(ydl, link)
+                file_path = _downloaded_path(ydl, info)
+        else:
+            async with _pooled_ydl((f"download-{media_type}", cookie_file), ydl_opts) as ydl:
+                info = await _download_with_retries(ydl, link)
+                file_path = _downloaded_path(ydl, info)
+        
+        # max_filesize skips oversized media without raising or writing a file
+        if not await aos.path.exists(file_path):
+            logger.warning(
+                f"Skipped {media_type} download of {video_id}, "
+                f"larger than {MAX_FILE_SIZE_MB} MB"
+            )
+            return None
+        
+        if media_type == "audio" and not file_path.endswith(".mp3"):
+            # Transcode outside yt-dlp so the next download isn't held up
+            src, file_path = file_path, os.path.splitext(file_path)[0] + ".mp3"
+            if not await _transcode_to_mp3(src, file_path):
+                return None
+        
+        if await aos.path.exists(file_path):
+            _DOWNLOADED.add(os.path.basename(file_path))
+            return file_path
     except Exception as e:
         logger.error(f"Failed to download {media_type}: {str(e)}")
     
     return None
 
-async def get_stream_url(link: str, media_type: str) -> Optional[str]:
-    """Get streaming URL using yt-dlp"""
-    cookie_file = cookie_txt_file()
+def _downloaded_path(ydl: yt_dlp.YoutubeDL, info: dict) -> str:
+    downloads = info.get("requested_downloads")
+    return downloads[0]["filepath"] if downloads else ydl.prepare_filename(info)
+
+def _retry_backoff(attempt: int) -> float:
+    """Exponential backoff between retries, starting at RETRY_DELAY"""
+    return RETRY_DELAY * 2 ** attempt
+
+def _is_transient(error: yt_dlp.utils.DownloadError) -> bool:
+    """Whether a failed download may succeed on retry"""
+    # Expected extractor errors are permanent: unavailable, private, no
+    # format within the size limit, ...
+    cause = error.exc_info[1] if error.exc_info else None
+    return not (isinstance(cause, yt_dlp.utils.ExtractorError) and cause.expected)
+
+async def _download_with_retries(ydl: yt_dlp.YoutubeDL, link: str) -> dict:
+    """Run a download, retrying transient failures with exponential backoff"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await asyncio.to_thread(ydl.extract_info, link, download=True)
+        except yt_dlp.utils.DownloadError as e:
+            if attempt == MAX_RETRIES - 1 or not _is_transient(e):
+                raise
+            delay = _retry_backoff(attempt)
+            logger.warning(f"Download failed, retrying in {delay}s: {str(e)}")
+            await asyncio.sleep(delay)
+
+async def _transcode_to_mp3(src: str, dst: str) -> bool:
+    """
+    Convert a downloaded file to mp3 with ffmpeg. The source is removed on
+    success and kept on failure, so a retry doesn't have to download it again
+    """
+    async with _TRANSCODE_SEMAPHORE:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-i", src, "-vn", "-b:a", "192k", dst,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await proc.communicate()
+    
+    if proc.returncode != 0:
+        logger.error(f"Failed to transcode {src}: {stderr.decode(errors='ignore')[-300:]}")
+        # Drop the partial output so it's never mistaken for a finished file
+        try:
+            await aos.remove(dst)
+        except OSError:
+            pass
+        return False
+    
+    try:
+        await aos.remove(src)
+    except OSError:
+        pass
+    return True
+
+async def _stream_info(link: str, media_type: str) -> Optional[dict]:
+    """Get the info dict with playable URLs for the selected format"""
+    cookie_file = await cookie_txt_file()
     if not cookie_file:
         logger.warning("No cookies found. Some videos may not stream.")
     
@@ -121,6 +512,7 @@ async def get_stream_url(link: str, media_type: str) -> Optional[str]:
         "format": "bestaudio/best" if media_type == "audio" else "bestvideo[height<=720]+bestaudio",
         "quiet": True,
         "no_warnings": True,
+        "socket_timeout": SOCKET_TIMEOUT,
         "geo_bypass": True,
         "nocheckcertificate": True,
     }
@@ -128,17 +520,71 @@ async def get_stream_url(link: str, media_type: str) -> Optional[str]:
     if cookie_file:
         ydl_opts["cookiefile"] = cookie_file
     
+    return await _cached_extract_info(link, media_type, ydl_opts)
+
+async def get_stream_url(link: str, media_type: str) -> Optional[str]:
+    """Get streaming URL using yt-dlp"""
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = await asyncio.to_thread(ydl.extract_info, link, download=False)
-            return info.get('url')
+        info = await _stream_info(link, media_type)
+        return info.get('url') if info else None
     except Exception as e:
         logger.error(f"Failed to get stream URL: {str(e)}")
         return None
 
-async def download_song(link: str) -> Optional[str]:
-    """Download audio from YouTube"""
-    return await download_with_yt_dlp(link, "audio")
+@asynccontextmanager
+async def download_to_pipe(link: str, media_type: str):
+    """
+    Remux media from YouTube into a fragmented mp4 on ffmpeg's stdout, for
+    callers that only forward the bytes and don't need a local file. Yields
+    the stdout StreamReader, or None on failure; ffmpeg is killed and reaped
+    when the block exits. Not used by any plugin yet.
+    """
+    try:
+        info = await _stream_info(link, media_type)
+    except Exception as e:
+        logger.error(f"Failed to get stream info: {str(e)}")
+        info = None
+    if not info:
+        yield None
+        return
+    
+    # Merged formats carry one URL per requested format
+    inputs = []
+    for f in info.get("requested_formats") or [info]:
+        headers = "".join(f"{k}: {v}\r\n" for k, v in (f.get("http_headers") or {}).items())
+        if headers:
+            inputs += ["-headers", headers]
+        # Microseconds, so a stalled URL fails instead of hanging forever
+        inputs += ["-rw_timeout", str(SOCKET_TIMEOUT * 1_000_000), "-i", f["url"]]
+    
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-loglevel", "error", *inputs,
+        "-c", "copy", "-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "pipe:1",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        yield proc.stdout
+    finally:
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        await proc.wait()
+
+async def download_song(link: str, prefer_stream: bool = True) -> Tuple[Optional[str], bool]:
+    """
+    Get audio from YouTube and return (file_path_or_url, is_local_file),
+    preferring a direct stream URL unless a local file is required
+    """
+    if prefer_stream:
+        stream_url = await get_stream_url(link, "audio")
+        if stream_url:
+            return stream_url, False
+    
+    file_path = await download_with_yt_dlp(link, "audio")
+    return (file_path, True) if file_path else (None, False)
 
 async def download_video(link: str) -> Optional[str]:
     """Download video from YouTube"""
@@ -146,7 +592,7 @@ async def download_video(link: str) -> Optional[str]:
 
 async def check_file_size(link: str) -> Optional[int]:
     """Check total file size of all formats"""
-    cookie_file = cookie_txt_file()
+    cookie_file = await cookie_txt_file()
     if not cookie_file:
         logger.warning("No cookies found. Cannot check file size.")
         return None
@@ -154,15 +600,18 @@ async def check_file_size(link: str) -> Optional[int]:
     ydl_opts = {
         "quiet": True,
         "no_warnings": True,
+        "socket_timeout": SOCKET_TIMEOUT,
         "cookiefile": cookie_file,
+        **_FORMAT_LIST_OPTS,
     }
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = await asyncio.to_thread(ydl.extract_info, link, download=False)
-            formats = info.get('formats', [])
-            total_size = sum(f.get('filesize', 0) for f in formats)
-            return total_size
+        info = await _cached_extract_info(link, "info", ydl_opts)
+        if not info:
+            return None
+        formats = info.get('formats', [])
+        total_size = sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats)
+        return total_size
     except Exception as e:
         logger.error(f"Failed to check file size: {str(e)}")
         return None
@@ -170,15 +619,14 @@ async def check_file_size(link: str) -> Optional[int]:
 class YouTubeAPI:
     def __init__(self):
         self.base = "https://www.youtube.com/watch?v="
-        self.regex = r"(?:youtube\.com|youtu\.be)"
         self.status = "https://www.youtube.com/oembed?url="
         self.listbase = "https://youtube.com/playlist?list="
-        self.reg = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+        self.reg = _ANSI_ESCAPE_RE
 
     async def exists(self, link: str, videoid: Union[bool, str] = None) -> bool:
         if videoid:
             link = self.base + link
-        return re.search(self.regex, link) is not None
+        return "youtube.com" in link or "youtu.be" in link
 
     async def url(self, message_1: Message) -> Optional[str]:
         messages = [message_1]
@@ -203,14 +651,13 @@ class YouTubeAPI:
         if "&" in link:
             link = link.split("&")[0]
             
-        results = VideosSearch(link, limit=1)
-        result = (await results.next())["result"][0]
+        result = (await _cached_search(link, 1))[0]
         
         title = result["title"]
-        duration_min = result["duration"]
-        thumbnail = result["thumbnails"][0]["url"].split("?")[0]
+        duration_min = _entry_duration(result)
+        thumbnail = _entry_thumbnail(result)
         vidid = result["id"]
-        duration_sec = 0 if str(duration_min) == "None" else int(time_to_seconds(duration_min))
+        duration_sec = int(result.get("duration") or 0)
         
         return title, duration_min, duration_sec, thumbnail, vidid
 
@@ -229,31 +676,70 @@ class YouTubeAPI:
         file_path = await download_video(link)
         return (1, file_path) if file_path else (0, "Failed to download video")
 
-    async def playlist(self, link: str, limit: int, user_id: int, videoid: Union[bool, str] = None) -> List[str]:
+    async def audio(
+        self,
+        link: str,
+        videoid: Union[bool, str] = None,
+        prefer_stream: bool = True,
+    ) -> Tuple[int, str]:
+        if videoid:
+            link = self.base + link
+        if "&" in link:
+            link = link.split("&")[0]
+        
+        file_path, _ = await download_song(link, prefer_stream)
+        return (1, file_path) if file_path else (0, "Failed to download audio")
+
+    async def playlist(
+        self,
+        link: str,
+        limit: int,
+        user_id: int,
+        videoid: Union[bool, str] = None,
+        prefetch_stream_urls: bool = False,
+    ) -> Union[List[str], List[Tuple[str, Optional[str]]]]:
+        """
+        Get playlist video IDs, or (video_id, stream_url) pairs when
+        prefetch_stream_urls is set
+        """
         if videoid:
             link = self.listbase + link
         if "&" in link:
             link = link.split("&")[0]
         
-        cookie_file = cookie_txt_file()
+        cookie_file = await cookie_txt_file()
         if not cookie_file:
             return []
         
         ydl_opts = {
             "quiet": True,
             "no_warnings": True,
+            "socket_timeout": SOCKET_TIMEOUT,
             "extract_flat": True,
             "cookiefile": cookie_file,
         }
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, link, download=False)
-                entries = info.get('entries', [])
-                return [entry['id'] for entry in entries[:limit] if 'id' in entry]
+            info = await _cached_extract_info(link, "playlist", ydl_opts)
+            if not info:
+                return []
+            entries = info.get('entries', [])
+            ids = [entry['id'] for entry in entries[:limit] if 'id' in entry]
         except Exception as e:
             logger.error(f"Failed to get playlist: {str(e)}")
             return []
+        
+        if not prefetch_stream_urls:
+            return ids
+        
+        sem = asyncio.Semaphore(PLAYLIST_PREFETCH_LIMIT)
+        
+        async def _bounded(vid: str) -> Optional[str]:
+            async with sem:
+                return await get_stream_url(self.base + vid, "audio")
+        
+        stream_urls = await asyncio.gather(*[_bounded(vid) for vid in ids])
+        return list(zip(ids, stream_urls))
 
     async def track(self, link: str, videoid: Union[bool, str] = None) -> Tuple[dict, str]:
         if videoid:
@@ -261,15 +747,14 @@ class YouTubeAPI:
         if "&" in link:
             link = link.split("&")[0]
             
-        results = VideosSearch(link, limit=1)
-        result = (await results.next())["result"][0]
+        result = (await _cached_search(link, 1))[0]
         
         track_details = {
             "title": result["title"],
-            "link": result["link"],
+            "link": self.base + result["id"],
             "vidid": result["id"],
-            "duration_min": result["duration"],
-            "thumb": result["thumbnails"][0]["url"].split("?")[0],
+            "duration_min": _entry_duration(result),
+            "thumb": _entry_thumbnail(result),
         }
         return track_details, result["id"]
 
@@ -279,34 +764,35 @@ class YouTubeAPI:
         if "&" in link:
             link = link.split("&")[0]
         
-        cookie_file = cookie_txt_file()
+        cookie_file = await cookie_txt_file()
         if not cookie_file:
             return [], link
         
         ydl_opts = {
             "quiet": True,
             "no_warnings": True,
+            "socket_timeout": SOCKET_TIMEOUT,
             "cookiefile": cookie_file,
+            **_FORMAT_LIST_OPTS,
         }
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, link, download=False)
-                formats = []
-                for f in info.get('formats', []):
-                    try:
-                        if not "dash" in str(f.get("format", "")).lower():
-                            formats.append({
-                                "format": f.get("format"),
-                                "filesize": f.get("filesize"),
-                                "format_id": f.get("format_id"),
-                                "ext": f.get("ext"),
-                                "format_note": f.get("format_note"),
-                                "yturl": link,
-                            })
-                    except:
-                        continue
-                return formats, link
+            info = await _cached_extract_info(link, "info", ydl_opts)
+            if not info:
+                return [], link
+            formats = [
+                {
+                    "format": f.get("format"),
+                    "filesize": f.get("filesize"),
+                    "format_id": f.get("format_id"),
+                    "ext": f.get("ext"),
+                    "format_note": f.get("format_note"),
+                    "yturl": link,
+                }
+                for f in info.get('formats', [])
+                if f.get("protocol") not in ("http_dash_segments", "dash")
+            ]
+            return formats, link
         except Exception as e:
             logger.error(f"Failed to get formats: {str(e)}")
             return [], link
@@ -322,14 +808,13 @@ class YouTubeAPI:
         if "&" in link:
             link = link.split("&")[0]
         
-        results = VideosSearch(link, limit=10)
-        result = (await results.next()).get("result")
+        result = await _cached_search(link, 10)
         selected = result[query_type]
         
         return (
             selected["title"],
-            selected["duration"],
-            selected["thumbnails"][0]["url"].split("?")[0],
+            _entry_duration(selected),
+            _entry_thumbnail(selected),
             selected["id"]
         )
 
@@ -364,7 +849,9 @@ class YouTubeAPI:
             file_path = await download_with_yt_dlp(link, "video", format_id, title)
             return (file_path, True) if file_path else (None, False)
         else:
-            # Default to audio download
-            file_path = await download_with_yt_dlp(link, "audio", format_id, title)
-            return (file_path, True) if file_path else (None, False)
+            if format_id and title:
+                file_path = await download_with_yt_dlp(link, "audio", format_id, title)
+                return (file_path, True) if file_path else (None, False)
+            # Default to audio, streamed directly when possible
+            return await download_song(link)
 
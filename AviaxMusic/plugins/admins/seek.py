@@ -47,7 +47,10 @@ async def seek_comm(cli, message: Message, _, chat_id):
         to_seek = duration_played + duration_to_skip + 1
     mystic = await message.reply_text(_["admin_24"])
     if "vid_" in file_path:
-        n, file_path = await YouTube.video(playing[0]["vidid"], True)
+        if playing[0]["streamtype"] == "video":
+            n, file_path = await YouTube.video(playing[0]["vidid"], True)
+        else:
+            n, file_path = await YouTube.audio(playing[0]["vidid"], True)
         if n == 0:
             return await message.reply_text(_["admin_22"])
     check = (playing[0]).get("speed_path")
@@ -1,18 +1,22 @@
 from pyrogram import filters
 from pyrogram.types import Message
 
-from AviaxMusic import app
+from AviaxMusic import YouTube, app
 from AviaxMusic.core.call import Aviax
 from AviaxMusic.misc import SUDOERS, db
 from AviaxMusic.utils import AdminRightsCheck
 from AviaxMusic.utils.database import is_active_chat, is_nonadmin_chat
 from AviaxMusic.utils.decorators.language import languageCB
 from AviaxMusic.utils.inline import close_markup, speed_markup
-from config import BANNED_USERS, adminlist
+from config import BANNED_USERS, adminlist, autoclean
 
 checker = []
 
 
+def is_streamed_audio(track: dict) -> bool:
+    return "vid_" in track["file"] and track["streamtype"] == "audio"
+
+
 @app.on_message(
     filters.command(["cspeed", "speed", "cslow", "slow", "playback", "cplayback"])
     & filters.group
@@ -27,7 +31,7 @@ async def playback(cli, message: Message, _, chat_id):
     if duration_seconds == 0:
         return await message.reply_text(_["admin_27"])
     file_path = playing[0]["file"]
-    if "downloads" not in file_path:
+    if "downloads" not in file_path and not is_streamed_audio(playing[0]):
         return await message.reply_text(_["admin_27"])
     upl = speed_markup(_, chat_id)
     return await message.reply_text(
@@ -61,7 +65,7 @@ async def del_back_playlist(client, CallbackQuery, _):
     if duration_seconds == 0:
         return await CallbackQuery.answer(_["admin_27"], show_alert=True)
     file_path = playing[0]["file"]
-    if "downloads" not in file_path:
+    if "downloads" not in file_path and not is_streamed_audio(playing[0]):
         return await CallbackQuery.answer(_["admin_27"], show_alert=True)
     checkspeed = (playing[0]).get("speed")
     if checkspeed:
@@ -93,6 +97,22 @@ async def del_back_playlist(client, CallbackQuery, _):
     mystic = await CallbackQuery.edit_message_text(
         text=_["admin_32"].format(CallbackQuery.from_user.mention),
     )
+    if is_streamed_audio(playing[0]):
+        # Streamed audio has no local file to re-encode, download it first
+        n, local_path = await YouTube.audio(
+            playing[0]["vidid"], True, prefer_stream=False
+        )
+        if n == 0 or str(db[chat_id][0]["file"]) != str(file_path):
+            if chat_id in checker:
+                checker.remove(chat_id)
+            return await mystic.edit_text(_["admin_33"], reply_markup=close_markup(_))
+        db[chat_id][0]["file"] = local_path
+        try:
+            autoclean.remove(file_path)
+        except ValueError:
+            pass
+        autoclean.append(local_path)
+        file_path = local_path
     try:
         await Aviax.speedup_stream(
             chat_id,
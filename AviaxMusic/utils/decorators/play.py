@@ -11,6 +11,7 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 from AviaxMusic import YouTube, app
 from AviaxMusic.misc import SUDOERS
+from AviaxMusic.platforms.Youtube import sticky_cookie
 from AviaxMusic.utils.database import (
     get_assistant,
     get_cmode,
@@ -181,16 +182,18 @@ def PlayWrapper(command):
                 except:
                     pass
 
-        return await command(
-            client,
-            message,
-            _,
-            chat_id,
-            video,
-            channel,
-            playmode,
-            url,
-            fplay,
-        )
+        # Keep one cookie file across the lookups and download of this command
+        async with sticky_cookie():
+            return await command(
+                client,
+                message,
+                _,
+                chat_id,
+                video,
+                channel,
+                playmode,
+                url,
+                fplay,
+            )
 
     return wrapper